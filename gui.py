@@ -1,58 +1,309 @@
 import argparse
+import collections
+import logging
+import os
 from pathlib import Path
+import queue
+import subprocess
+import threading
 import tkinter
 from typing import Callable, List, Tuple, Optional
 
 import numpy as np
+
+# Let FFmpeg decode on as many threads as it sees fit. This is read when a capture is opened, but set it before cv2 is
+# imported so that it's in place however the capture ends up being created
+os.environ.setdefault("OPENCV_FFMPEG_CAPTURE_OPTIONS", "threads;auto")
 import cv2
+import PIL
 from PIL import Image, ImageTk
 
+from video import open_capture, parse_resolution
+
+try:
+    import av
+except ImportError:  # PyAV is optional, the output is written with OpenCV without it
+    av = None
+try:
+    from OpenGL import GL
+    from pyopengltk import OpenGLFrame
+except ImportError:  # pyopengltk is optional, the preview is drawn through a Tk photo image without it
+    OpenGLFrame = None
+try:
+    from numba import njit, prange
+except ImportError:  # Numba is optional, the fused processors fall back to OpenCV without it
+    njit = None
+
+logger = logging.getLogger(__name__)
+
 
 # Define some default arguments since the problem statement asks for the script to be runnable without command line
 # arguments
 VIDEO_PATH = "data/video_1.mp4"
 FRAME_RATE = 20
+# How close, in frames per second, the source frame rate must be to the target for the video to be remuxed
+FRAME_RATE_TOLERANCE = 0.01
+
+# The largest size the preview is displayed at. Larger videos are downscaled for display only, the output file is
+# still written at the output resolution
+PREVIEW_RESOLUTION = (960, 540)
+
+# The scale at which the background subtractor runs. The foreground mask is upsampled back to the full frame size
+SEGMENTATION_SCALE = 0.5
+
+# Hardware H.264 encoders to try, in order of preference, before falling back to OpenCV's software mp4v encoder
+HARDWARE_ENCODERS = ["h264_nvenc"]
+
+# Threads in the pipeline besides the processor, which is the one driving OpenCV's thread pool
+PIPELINE_THREADS = 2
+
+# Maximum number of frames buffered between each stage of the processing pipeline
+QUEUE_SIZE = 4
+# Maximum number of processed frames waiting to be written. Encoding is the slowest stage, so give it more slack
+ENCODE_QUEUE_SIZE = 8
+# Number of output buffers each processor cycles through. Every processed frame may be sitting in a queue, or be in
+# use by the processor, encoder and GUI threads, so buffers are only reused once they can no longer be referenced
+BUFFER_COUNT = max(QUEUE_SIZE, ENCODE_QUEUE_SIZE) + 3
+
+# Number of recently displayed frames kept in memory so stepping back doesn't need to seek and decode again
+RECENT_FRAMES = 30
+# How often, in seconds, blocked pipeline threads check whether they should stop
+POLL_INTERVAL = 0.1
+
+
+if njit is not None:
+
+    @njit(parallel=True, fastmath=True, cache=True)
+    def fuse_mask(gray: np.ndarray, mask: np.ndarray, out: np.ndarray):
+        """Write the masked grayscale image into all three channels of out in a single pass"""
+        height, width = gray.shape
+        for y in prange(height):
+            for x in range(width):
+                value = gray[y, x] if mask[y, x] else 0
+                out[y, x, 0] = value
+                out[y, x, 1] = value
+                out[y, x, 2] = value
+
+else:
+    fuse_mask = None
+
+
+class FrameBuffers:
+    """A ring of preallocated frames which processors write their output into
+
+    Processed frames are handed to the other pipeline stages through queues, so a buffer can only be reused once every
+    frame which could still be queued has been consumed. The ring is sized to cover the queues plus the frames being
+    worked on by each stage.
+    """
+
+    def __init__(self, count: int = BUFFER_COUNT):
+        self._buffers = [None] * count
+        self._index = 0
+
+    def next(self, shape: Tuple[int, ...]) -> np.ndarray:
+        buffer = self._buffers[self._index]
+        if buffer is None or buffer.shape != shape:
+            buffer = self._buffers[self._index] = np.empty(shape, dtype=np.uint8)
+        self._index = (self._index + 1) % len(self._buffers)
+        return buffer
+
+
+class ForegroundMask:
+    """Run a background subtractor on a downscaled copy of the image and upsample the mask to the image size"""
+
+    def __init__(self, subtractor: cv2.BackgroundSubtractor, scale: float):
+        self.subtractor = subtractor
+        self.scale = scale
+        # Intermediate buffers, allocated by OpenCV on the first call and written in place after that
+        self._small = None
+        self._small_mask = None
+        self._mask = None
+
+    def __call__(self, image: np.ndarray) -> np.ndarray:
+        if self.scale == 1.0:
+            self._mask = self.subtractor.apply(image, self._mask)
+            return self._mask
+        self._small = cv2.resize(
+            image, None, dst=self._small, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA
+        )
+        self._small_mask = self.subtractor.apply(self._small, self._small_mask)
+        self._mask = cv2.resize(
+            self._small_mask, (image.shape[1], image.shape[0]), dst=self._mask, interpolation=cv2.INTER_NEAREST
+        )
+        return self._mask
 
 
 class SegmentationFunctor:
     """A functor which applies some segmentation algorithm to an image"""
 
-    def __init__(self, subtractor: cv2.BackgroundSubtractor):
+    def __init__(self, subtractor: cv2.BackgroundSubtractor, scale: float = SEGMENTATION_SCALE):
         self.subtractor = subtractor
+        self.scale = scale
+        self._foreground_mask = ForegroundMask(subtractor, scale)
+        self._out = FrameBuffers()
+
+    def __call__(self, image: np.ndarray) -> np.ndarray:
+        forground_mask = self._foreground_mask(image)
+        # The masked AND only writes where the mask is set, so clear the reused buffer of the frame it last held
+        out = self._out.next(image.shape)
+        out.fill(0)
+        return cv2.bitwise_and(image, image, dst=out, mask=forground_mask)
+
+
+class MonochromeFunctor:
+    """A functor which converts an image to grayscale"""
+
+    def __init__(self):
+        self._gray = None
+        self._out = FrameBuffers()
 
     def __call__(self, image: np.ndarray) -> np.ndarray:
-        forground_mask = self.subtractor.apply(image)
-        return cv2.bitwise_and(image, image, mask=forground_mask)
+        self._gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=self._gray)
+        # Convert the image to three channel grayscale
+        return cv2.cvtColor(self._gray, cv2.COLOR_GRAY2BGR, dst=self._out.next(image.shape[:2] + (3,)))
+
 
+class MonochromeSegmentationFunctor:
+    """A functor which converts an image to grayscale and segments it in a single pass
 
-def monochrome_fn(image: np.ndarray) -> np.ndarray:
-    """A function which converts an image to grayscale"""
-    image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    # Convert the image to three channel grayscale
-    image = np.stack((image,) * 3, axis=-1)
-    return image
+    Close to, but not identical to, a `MonochromeFunctor` followed by a `SegmentationFunctor`. The background
+    subtractor is given the single channel gray image rather than its three channel expansion, so a few pixels per
+    frame can be classified differently. The mask is applied before the image is expanded to three channels, which
+    saves a full frame conversion and allocation. When Numba is installed, masking and expanding to three channels
+    happen together in one parallel pass.
+    """
 
+    def __init__(self, subtractor: cv2.BackgroundSubtractor, scale: float = SEGMENTATION_SCALE):
+        self.subtractor = subtractor
+        self.scale = scale
+        self._foreground_mask = ForegroundMask(subtractor, scale)
+        self._gray = None
+        self._masked = None
+        self._out = FrameBuffers()
 
-# A function which converts an image to RGB
-rgb_fn = lambda image: cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    def __call__(self, image: np.ndarray) -> np.ndarray:
+        self._gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=self._gray)
+        forground_mask = self._foreground_mask(self._gray)
+        out = self._out.next(image.shape[:2] + (3,))
+        if fuse_mask is not None:
+            fuse_mask(self._gray, forground_mask, out)
+            return out
+        # The masked AND only writes where the mask is set, so clear the reused buffer of the previous frame
+        if self._masked is not None:
+            self._masked.fill(0)
+        self._masked = cv2.bitwise_and(self._gray, self._gray, dst=self._masked, mask=forground_mask)
+        return cv2.cvtColor(self._masked, cv2.COLOR_GRAY2BGR, dst=out)
+
+
+def compose_processors(processors: List[Callable]) -> Callable:
+    """Fuse a chain of processors into a single callable which is built once rather than walked for every frame"""
+    processors = tuple(processors)
+    if not processors:
+        return lambda image: image
+    if len(processors) == 1:
+        return processors[0]
+    if (
+        len(processors) == 2
+        and isinstance(processors[0], MonochromeFunctor)
+        and isinstance(processors[1], SegmentationFunctor)
+    ):
+        return MonochromeSegmentationFunctor(processors[1].subtractor, processors[1].scale)
+
+    # Generate a function which calls each processor in turn, with the processors bound as default arguments so they
+    # are fast locals rather than looked up through a list on every frame
+    arguments = "".join(f", _p{i}=_p{i}" for i in range(len(processors)))
+    body = "".join(f"    image = _p{i}(image)\n" for i in range(len(processors)))
+    source = f"def process(image{arguments}):\n{body}    return image\n"
+    namespace = {f"_p{i}": fn for i, fn in enumerate(processors)}
+    exec(source, namespace)
+    return namespace["process"]
+
+
+class AVWriter:
+    """Writes BGR frames to an H.264 file through one of FFmpeg's hardware encoders
+
+    Exposes the `write` and `release` methods of `cv2.VideoWriter` so the two can be used interchangeably. Frames are
+    scaled to the output resolution by FFmpeg as part of the conversion to YUV.
+    """
+
+    def __init__(self, path: str, codec: str, frame_rate: int, resolution: Tuple[int, int]):
+        self.container = av.open(path, "w")
+        try:
+            self.stream = self.container.add_stream(codec, rate=frame_rate)
+            self.stream.width, self.stream.height = resolution
+            self.stream.pix_fmt = "yuv420p"
+            # Open the encoder now so that a missing device fails here rather than on the first frame
+            self.stream.codec_context.open()
+        except Exception:
+            self.container.close()
+            raise
+
+    def write(self, frame: np.ndarray):
+        for packet in self.stream.encode(av.VideoFrame.from_ndarray(frame, format="bgr24")):
+            self.container.mux(packet)
+
+    def release(self):
+        # Flush the frames still buffered in the encoder
+        for packet in self.stream.encode():
+            self.container.mux(packet)
+        self.container.close()
+
+
+def open_writer(path: str, frame_rate: int, resolution: Tuple[int, int]):
+    """Open a hardware H.264 writer if PyAV and a supported encoder are available, otherwise an OpenCV mp4v writer"""
+    if av is not None:
+        for codec in HARDWARE_ENCODERS:
+            try:
+                return AVWriter(path, codec, frame_rate, resolution)
+            except Exception as e:
+                logger.info("Unable to use the %s encoder: %s", codec, e)
+    return cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), frame_rate, resolution)
+
+
+def has_frame_rate(video_source: str, frame_rate: float) -> bool:
+    """Check whether a video already plays at the given frame rate, so that remuxing it keeps the output duration"""
+    capture = open_capture(video_source)
+    source_frame_rate = capture.get(cv2.CAP_PROP_FPS)
+    capture.release()
+    return abs(source_frame_rate - frame_rate) < FRAME_RATE_TOLERANCE
+
+
+def remux(video_source: str, video_output_path: str) -> bool:
+    """Copy the streams of a video into a new container with FFmpeg, without decoding or encoding any frames"""
+    try:
+        subprocess.run(
+            ["ffmpeg", "-y", "-loglevel", "error", "-i", video_source, "-c", "copy", video_output_path],
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError) as e:
+        logger.warning("Unable to remux %s, falling back to re-encoding: %s", video_source, e)
+        return False
+    return True
 
 
 class VideoProcessor:
-    """Take a source video, apply some set of processing to it and store locally"""
+    """Take a source video, apply some set of processing to it and store locally
+
+    Decoding, processing and encoding each run on their own daemon thread and hand frames to each other through
+    bounded queues, so throughput is limited by the slowest stage rather than the sum of all of them. Processed frames
+    are made available to the GUI through `get_frame`. Without the GUI, call `run_offline` instead.
+    """
 
     def __init__(
         self,
         video_source: str,
         processors: List[Callable],
-        video_output_path: str,
+        video_output_path: Optional[str],
         output_resolution: Optional[Tuple[int, int]],
         output_frame_rate: int = 20,
     ):
-        self.vid = cv2.VideoCapture(video_source)
+        self.vid = open_capture(video_source)
         if not self.vid.isOpened():
             raise ValueError("Unable to open video source", video_source)
 
         self.processors = processors
+        # Apply the chained processing steps to the raw frame with a single call
+        self._apply = compose_processors(processors)
 
         # Get video source width and height
         self.width = int(self.vid.get(cv2.CAP_PROP_FRAME_WIDTH))
@@ -61,41 +312,360 @@ class VideoProcessor:
         # Configure the video output
         if output_resolution is None:
             output_resolution = (self.width, self.height)
-        self.out = cv2.VideoWriter(
-            video_output_path, cv2.VideoWriter_fourcc(*"mp4v"), output_frame_rate, output_resolution
-        )
+        self.output_resolution = output_resolution
+        # With no output path, frames are only processed for display
+        self.out = None
+        if video_output_path is not None:
+            self.out = open_writer(video_output_path, output_frame_rate, output_resolution)
+
+        # Queues between the pipeline stages. They are bounded so that a slow stage applies back-pressure to the
+        # stages before it and memory use stays constant
+        self.raw_q = queue.Queue(QUEUE_SIZE)
+        self.proc_q = queue.Queue(QUEUE_SIZE)
+        self.enc_q = queue.Queue(ENCODE_QUEUE_SIZE)
+
+        # The capture is shared between the decoder thread and `set_frame_back`. Every seek bumps the generation so
+        # that frames decoded before the seek can be recognised and dropped downstream
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._next_index = 0
+        self._current_index = -1
+        self._last_written_index = -1
+        self._seeked = threading.Event()
+        self._stopped = threading.Event()
+        self._closed = False
+        # An error raised by the encoder thread, which stops the pipeline and is raised again on the calling thread
+        self._error = None
+
+        # Frames most recently returned by `get_frame`, with their indices. While stepping back, the cursor points at
+        # the frame in here which is being displayed and `get_frame` replays forwards from it
+        self._recent = collections.deque(maxlen=RECENT_FRAMES)
+        self._cursor = None
+
+        self._decoder = threading.Thread(target=self._decode_loop, daemon=True)
+        self._processor = threading.Thread(target=self._process_loop, daemon=True)
+        self._encoder = threading.Thread(target=self._encode_loop, daemon=True)
+        for thread in (self._decoder, self._processor, self._encoder):
+            thread.start()
 
     def __del__(self):
+        # Nothing has been set up if the video source failed to open
+        if hasattr(self, "_stopped"):
+            self.close()
+
+    def close(self):
+        """Stop the pipeline, flush any pending frames to the output file and release the video handles"""
+        if self._closed:
+            return
+        self._closed = True
+        self._stopped.set()
+        self._decoder.join()
+        self._processor.join()
+
+        # Everything which was processed is written before the output is released
+        self.enc_q.put(None)
+        self._encoder.join()
+
         if self.vid.isOpened():
             self.vid.release()
         if self.out is not None:
             self.out.release()
-        cv2.destroyAllWindows()
-
-    def get_frame(self):
-        if self.vid.isOpened():
-            ret, frame = self.vid.read()
-            if ret:
-                for fn in self.processors:  # Apply the chained processing steps to the raw frame
-                    frame = fn(frame)
-                return (ret, frame)
-        return (False, None)
+        self._raise_error()
+
+    def _raise_error(self):
+        """Raise the error which stopped the pipeline, if there was one"""
+        if self._error is not None:
+            raise self._error
+
+    def run_offline(self):
+        """Process the whole video straight to the output file, without displaying it
+
+        The pipeline threads do all of the work. Processed frames only need to be taken off the display queue so that
+        it doesn't hold the processor up.
+        """
+        while True:
+            item = self._get(self.proc_q)
+            if item is None:
+                # The pipeline only stops before the end of the stream if the encoder failed
+                self._raise_error()
+                return
+            _, _, frame = item
+            if frame is None:
+                return
+
+    def _put(self, q: queue.Queue, item) -> bool:
+        """Blocking put which gives up once the pipeline is stopped"""
+        while not self._stopped.is_set():
+            try:
+                q.put(item, timeout=POLL_INTERVAL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q: queue.Queue):
+        """Blocking get which gives up once the pipeline is stopped"""
+        while not self._stopped.is_set():
+            try:
+                return q.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                continue
+        return None
+
+    def _decode_loop(self):
+        while not self._stopped.is_set():
+            with self._lock:
+                generation = self._generation
+                ret, frame = self.vid.read()
+                index = self._next_index
+                self._next_index += 1
+
+            # A frame of None marks the end of the stream
+            if not self._put(self.raw_q, (generation, index, frame if ret else None)):
+                break
+
+            if not ret:
+                # Nothing left to decode, wait until the stream is rewound by a step back
+                while not self._stopped.is_set() and not self._seeked.wait(POLL_INTERVAL):
+                    pass
+                self._seeked.clear()
+
+    def _process_loop(self):
+        while not self._stopped.is_set():
+            item = self._get(self.raw_q)
+            if item is None:
+                break
+            generation, index, frame = item
+            if generation != self._generation:
+                continue
+
+            if frame is not None:
+                frame = self._apply(frame)
+                if self.out is not None and not self._put(self.enc_q, (index, frame)):
+                    break
+            self._put(self.proc_q, (generation, index, frame))
+
+    def _encode_loop(self):
+        resized = None
+        while True:
+            item = self.enc_q.get()
+            if item is None:
+                break
+            if self._error is not None:
+                # Keep draining the queue after a failure so that nothing blocks on putting into it
+                continue
+            index, frame = item
+            # Frames which are decoded again after a step back have already been written
+            if index <= self._last_written_index:
+                continue
+            try:
+                # OpenCV's writer silently drops frames which don't match its resolution
+                if isinstance(self.out, cv2.VideoWriter) and frame.shape[1::-1] != self.output_resolution:
+                    resized = cv2.resize(frame, self.output_resolution, dst=resized, interpolation=cv2.INTER_AREA)
+                    frame = resized
+                self.out.write(frame)
+            except Exception as e:
+                self._error = e
+                self._stopped.set()
+                continue
+            self._last_written_index = index
+
+    def get_frame(self, block: bool = True) -> Tuple[bool, Optional[np.ndarray]]:
+        """Get the next processed frame
+
+        Raises `queue.Empty` if `block` is False and the next frame has not been processed yet, or the error which
+        stopped the pipeline if writing the output failed.
+        """
+        self._raise_error()
+        if self._cursor is not None:
+            self._cursor += 1
+            if self._cursor < len(self._recent):
+                self._current_index, frame = self._recent[self._cursor]
+                return (True, frame)
+            # Caught up with the pipeline again
+            self._cursor = None
+
+        while True:
+            try:
+                generation, index, frame = self.proc_q.get(block=block, timeout=POLL_INTERVAL if block else None)
+            except queue.Empty:
+                # Nothing more will arrive if the pipeline has stopped
+                self._raise_error()
+                if not block:
+                    raise
+                continue
+            if generation == self._generation:
+                break
+
+        if frame is None:
+            return (False, None)
+        self._current_index = index
+        self._remember(index, frame)
+        return (True, frame)
+
+    def _remember(self, index: int, frame: np.ndarray):
+        """Keep a copy of the frame for stepping back, since the processor will reuse its buffer"""
+        buffer = None
+        if len(self._recent) == self._recent.maxlen:
+            # Recycle the buffer of the frame which is about to fall out of the history
+            _, buffer = self._recent[0]
+        if buffer is None or buffer.shape != frame.shape:
+            buffer = frame.copy()
+        else:
+            np.copyto(buffer, frame)
+        self._recent.append((index, buffer))
 
     def set_frame_back(self, num_frames: int = 1):
-        current_frame = self.vid.get(cv2.CAP_PROP_POS_FRAMES) - 1
-        self.vid.set(cv2.CAP_PROP_POS_FRAMES, current_frame - num_frames)
+        # Step back through the recently displayed frames if we can
+        position = (len(self._recent) - 1 if self._cursor is None else self._cursor) - num_frames
+        if position >= 0:
+            self._cursor = position - 1
+            return
+
+        # Otherwise seek the capture and decode from there
+        self._recent.clear()
+        self._cursor = None
+        with self._lock:
+            self._generation += 1
+            self._next_index = max(self._current_index - num_frames, 0)
+            self.vid.set(cv2.CAP_PROP_POS_FRAMES, self._next_index)
+
+            # Throw away the frames which were decoded ahead of the seek
+            for q in (self.raw_q, self.proc_q):
+                while True:
+                    try:
+                        q.get_nowait()
+                    except queue.Empty:
+                        break
+        self._seeked.set()
+
+
+class PhotoPreview:
+    """Displays frames on a Tk canvas through a photo image which is updated in place"""
+
+    def __init__(self, master: tkinter.Misc, size: Tuple[int, int]):
+        self.size = size
+        self.canvas = tkinter.Canvas(master, width=size[0], height=size[1])
+
+        # Allocate a single photo and canvas item up front. Each frame is pasted into the photo in place rather than
+        # creating a new photo and canvas item for every frame
+        self.photo = ImageTk.PhotoImage(Image.new("RGB", size))
+        self.canvas_item = self.canvas.create_image(0, 0, image=self.photo, anchor=tkinter.NW)
+        # Buffers for the downscaled and RGB preview frames, allocated on the first frame and reused after that
+        self._preview = None
+        self._rgb = None
+        self._paste = self.photo.paste
+
+    def pack(self):
+        self.canvas.pack()
+
+    def show(
+        self,
+        frame: np.ndarray,
+        _resize=cv2.resize,
+        _cvt=cv2.cvtColor,
+        _fromarray=Image.fromarray,
+        _INTER_AREA=cv2.INTER_AREA,
+        _BGR2RGB=cv2.COLOR_BGR2RGB,
+    ):
+        # Called for every frame, so the module level functions and constants are bound as default arguments to make
+        # them fast locals
+        if frame.shape[1::-1] != self.size:
+            frame = self._preview = _resize(frame, self.size, dst=self._preview, interpolation=_INTER_AREA)
+        self._rgb = _cvt(frame, _BGR2RGB, dst=self._rgb)
+        self._paste(_fromarray(self._rgb))
+
+
+if OpenGLFrame is not None:
+
+    class GLPreview(OpenGLFrame):
+        """Displays frames by uploading them as an OpenGL texture, straight from BGR and without going through PIL
+
+        Scaling to the preview size happens on the GPU when the texture is drawn.
+        """
+
+        def __init__(self, master: tkinter.Misc, size: Tuple[int, int]):
+            super().__init__(master, width=size[0], height=size[1])
+            self._frame = None
+            self._texture = None
+            self._texture_shape = None
+
+        def initgl(self):
+            # pyopengltk calls this again whenever the frame is resized, so keep the texture and the last frame in it
+            GL.glViewport(0, 0, self.winfo_width(), self.winfo_height())
+            GL.glClearColor(0.0, 0.0, 0.0, 1.0)
+            GL.glEnable(GL.GL_TEXTURE_2D)
+            # Rows of BGR frames aren't padded to four bytes
+            GL.glPixelStorei(GL.GL_UNPACK_ALIGNMENT, 1)
+            if self._texture is None:
+                self._texture = GL.glGenTextures(1)
+                GL.glBindTexture(GL.GL_TEXTURE_2D, self._texture)
+                GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_LINEAR)
+                GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_LINEAR)
+
+        def redraw(self):
+            GL.glClear(GL.GL_COLOR_BUFFER_BIT)
+            if self._frame is not None:
+                height, width = self._frame.shape[:2]
+                if self._frame.shape != self._texture_shape:
+                    GL.glTexImage2D(
+                        GL.GL_TEXTURE_2D, 0, GL.GL_RGB, width, height, 0, GL.GL_BGR, GL.GL_UNSIGNED_BYTE, self._frame
+                    )
+                    self._texture_shape = self._frame.shape
+                else:
+                    GL.glTexSubImage2D(
+                        GL.GL_TEXTURE_2D, 0, 0, 0, width, height, GL.GL_BGR, GL.GL_UNSIGNED_BYTE, self._frame
+                    )
+                # Don't hold on to the frame, its buffer will be reused by the processor
+                self._frame = None
+            if self._texture_shape is None:
+                return
+
+            # Draw the texture over the whole viewport. Frames are stored top row first, so flip it vertically
+            GL.glBegin(GL.GL_QUADS)
+            GL.glTexCoord2f(0.0, 1.0)
+            GL.glVertex2f(-1.0, -1.0)
+            GL.glTexCoord2f(1.0, 1.0)
+            GL.glVertex2f(1.0, -1.0)
+            GL.glTexCoord2f(1.0, 0.0)
+            GL.glVertex2f(1.0, 1.0)
+            GL.glTexCoord2f(0.0, 0.0)
+            GL.glVertex2f(-1.0, 1.0)
+            GL.glEnd()
+
+        def show(self, frame: np.ndarray):
+            # The GL context is only created once the frame is mapped, frames which arrive before then are dropped
+            if not self.context_created:
+                return
+            self._frame = frame
+            self.tkExpose(None)
 
 
 class App:
-    def __init__(self, window: tkinter.Tk, window_title: str, video_processor: VideoProcessor):
+    def __init__(
+        self,
+        window: tkinter.Tk,
+        window_title: str,
+        video_processor: VideoProcessor,
+        preview_resolution: Tuple[int, int] = PREVIEW_RESOLUTION,
+    ):
         self.window = window
         self.window.title(window_title)
 
         self.vid = video_processor
 
-        # Create a canvas that can fit the above video source size
-        self.canvas = tkinter.Canvas(window, width=self.vid.width, height=self.vid.height)
-        self.canvas.pack()
+        # Fit the video source into the preview resolution, keeping its aspect ratio. Sources which already fit are
+        # displayed as they are
+        scale = min(preview_resolution[0] / self.vid.width, preview_resolution[1] / self.vid.height, 1.0)
+        # Neither side may round down to nothing for tiny display resolutions
+        self.preview_size = (max(1, int(self.vid.width * scale)), max(1, int(self.vid.height * scale)))
+
+        self.preview = self._create_preview()
+
+        # Bound methods used on every frame, looked up once here rather than on each update
+        self._get_frame = video_processor.get_frame
+        self._show = self.preview.show
+        self._after = window.after
 
         self.pause_button = tkinter.Button(window, text="Pause", width=50, command=self.pause)
         self.pause_button.pack(anchor=tkinter.CENTER, expand=True)
@@ -113,6 +683,27 @@ class App:
 
         self.window.mainloop()
 
+    def _create_preview(self):
+        """Draw the preview with OpenGL if it's available, otherwise through a Tk photo image"""
+        if OpenGLFrame is not None:
+            preview = None
+            try:
+                preview = GLPreview(self.window, self.preview_size)
+                preview.pack()
+                # pyopengltk creates the GL context when the frame is first mapped, so map it now to check it worked
+                self.window.update()
+                if preview.context_created:
+                    return preview
+                logger.warning("Unable to create an OpenGL context, falling back to a Tk preview")
+            except Exception as e:
+                logger.warning("Unable to create an OpenGL preview, falling back to a Tk preview: %s", e)
+            if preview is not None:
+                preview.destroy()
+
+        preview = PhotoPreview(self.window, self.preview_size)
+        preview.pack()
+        return preview
+
     def pause(self):
         self.paused = not self.paused
         if self.paused:
@@ -130,20 +721,31 @@ class App:
             self.vid.set_frame_back()
             self.show_frame()
 
-    def show_frame(self):
-        ret, frame = self.vid.get_frame()
+    def show_frame(self, block: bool = True) -> bool:
+        try:
+            ret, frame = self._get_frame(block=block)
+        except queue.Empty:
+            raise
+        except Exception:
+            # The pipeline failed. Close the window so that `main` can release the pipeline and report the error
+            self.window.destroy()
+            raise
         if ret:
-            self.photo = ImageTk.PhotoImage(image=Image.fromarray(rgb_fn(frame)))
-            self.canvas.create_image(0, 0, image=self.photo, anchor=tkinter.NW)
-            return frame
+            self._show(frame)
+            return True
         else:
             self.window.destroy()
-            return None
+            return False
 
     def update(self):
-        frame = self.show_frame()
-        self.vid.out.write(frame)
-        self.play = self.window.after(self.delay, self.update)
+        # Writing the output happens on the pipeline's encoder thread, so all that's left here is to display whatever
+        # frame is ready. If the pipeline hasn't caught up yet, just try again on the next tick
+        try:
+            if not self.show_frame(block=False):
+                return
+        except queue.Empty:
+            pass
+        self.play = self._after(self.delay, self.update)
 
 
 def main():
@@ -153,7 +755,16 @@ def main():
     parser.add_argument("--target-file-path", help="The filepath of the video to extract", type=Path, default=None)
     parser.add_argument("--frame-rate", help="The target frame rate", type=int, default=FRAME_RATE)
     parser.add_argument(
-        "--output-resolution", help="The resolution of the output file", type=Tuple[int, int], default=None
+        "--output-resolution",
+        help="The resolution of the output file, as WIDTHxHEIGHT",
+        type=parse_resolution,
+        default=None,
+    )
+    parser.add_argument(
+        "--display-resolution",
+        help="The largest resolution to display the video at, as WIDTHxHEIGHT",
+        type=parse_resolution,
+        default=PREVIEW_RESOLUTION,
     )
     parser.add_argument("--monochrome", help="If set, play the video in monochrome", action="store_true")
     parser.add_argument(
@@ -161,6 +772,11 @@ def main():
         help="If set, run the segmentation algorithm and save the result to the target path",
         action="store_true",
     )
+    parser.add_argument(
+        "--no-gui",
+        help="If set, process the video straight to the target path without playing it",
+        action="store_true",
+    )
     parser.add_argument(
         "--log-level",
         help="Set the logger level",
@@ -169,6 +785,17 @@ def main():
     )
     args = parser.parse_args()
 
+    logging.basicConfig(level=args.log_level)
+    # Pillow-SIMD releases carry a .postN suffix, stock Pillow does not
+    if ".post" not in PIL.__version__:
+        logger.warning("Stock Pillow %s detected, install Pillow-SIMD for a faster preview", PIL.__version__)
+
+    # Leave a core each for the decoder and encoder threads so OpenCV's thread pool doesn't oversubscribe the CPU
+    num_threads = max(2, (os.cpu_count() or 1) - PIPELINE_THREADS)
+    cv2.setUseOptimized(True)
+    cv2.setNumThreads(num_threads)
+    logger.info("Using %d OpenCV threads", num_threads)
+
     if args.target_file_path is not None:
         target_file_path = args.target_file_path
     else:
@@ -178,26 +805,48 @@ def main():
     # number of operations to apply on the image
     processors = []
     if args.monochrome:
-        processors.append(monochrome_fn)
+        processors.append(MonochromeFunctor())
     if args.segment:
         # Create a segmentation function using standard opencv function. Note that this has not been optimised in any
         # way but in the future, could replace this with a deep neural network.
         processors.append(SegmentationFunctor(cv2.createBackgroundSubtractorMOG2()))
 
+    # With nothing to change in the frames themselves, the output is just a copy of the source. Rewrap the streams
+    # rather than decoding and re-encoding every frame
+    video_output_path = str(target_file_path)
+    if (
+        not processors
+        and args.output_resolution is None
+        and has_frame_rate(str(args.video_file_path), args.frame_rate)
+        and remux(str(args.video_file_path), video_output_path)
+    ):
+        if args.no_gui:
+            return
+        # The GUI is still shown as a preview, but there's nothing left for it to write
+        video_output_path = None
+
     video_processor = VideoProcessor(
         video_source=str(args.video_file_path),
         processors=processors,
-        video_output_path=str(target_file_path),
+        video_output_path=video_output_path,
         output_resolution=args.output_resolution,
         output_frame_rate=args.frame_rate,
     )
 
-    # Run the application
-    App(
-        window=tkinter.Tk(),
-        window_title="Video Playback GUI",
-        video_processor=video_processor,
-    )
+    try:
+        if args.no_gui:
+            video_processor.run_offline()
+        else:
+            # Run the application
+            App(
+                window=tkinter.Tk(),
+                window_title="Video Playback GUI",
+                video_processor=video_processor,
+                preview_resolution=args.display_resolution,
+            )
+    finally:
+        # The pipeline threads keep a reference to the processor, so flush and release the output explicitly
+        video_processor.close()
 
 
 if __name__ == "__main__":
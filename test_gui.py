@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+gui = pytest.importorskip("gui")
+
+
+def make_frames(count: int):
+    """A static noisy background with a bright square moving across it"""
+    background = np.random.RandomState(0).randint(0, 256, size=(120, 160, 3), dtype=np.uint8)
+    for i in range(count):
+        frame = background.copy()
+        x = (i * 5) % 120
+        frame[40:80, x : x + 40] = 255
+        yield frame
+
+
+@pytest.mark.parametrize("scale", [1.0, gui.SEGMENTATION_SCALE])
+def test_segmentation_matches_unbuffered(scale):
+    functor = gui.SegmentationFunctor(cv2.createBackgroundSubtractorMOG2(), scale)
+    reference_mask = gui.ForegroundMask(cv2.createBackgroundSubtractorMOG2(), scale)
+
+    # Run for long enough that every output buffer is reused
+    for frame in make_frames(2 * gui.BUFFER_COUNT + 1):
+        expected = cv2.bitwise_and(frame, frame, mask=reference_mask(frame))
+        np.testing.assert_array_equal(functor(frame), expected)
+
+
+@pytest.mark.parametrize("scale", [1.0, gui.SEGMENTATION_SCALE])
+def test_monochrome_segmentation_matches_unbuffered(monkeypatch, scale):
+    # Exercise the OpenCV path rather than the Numba kernel
+    monkeypatch.setattr(gui, "fuse_mask", None)
+    functor = gui.MonochromeSegmentationFunctor(cv2.createBackgroundSubtractorMOG2(), scale)
+    reference_mask = gui.ForegroundMask(cv2.createBackgroundSubtractorMOG2(), scale)
+
+    for frame in make_frames(2 * gui.BUFFER_COUNT + 1):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        masked = cv2.bitwise_and(gray, gray, mask=reference_mask(gray))
+        np.testing.assert_array_equal(functor(frame), cv2.cvtColor(masked, cv2.COLOR_GRAY2BGR))
+
+
+@pytest.mark.skipif(gui.fuse_mask is None, reason="Numba is not installed")
+def test_fuse_mask_matches_opencv():
+    random = np.random.RandomState(0)
+    gray = random.randint(0, 256, size=(120, 160), dtype=np.uint8)
+    # MOG2 marks shadows with 127, which count as foreground like 255 does
+    mask = random.choice(np.array([0, 127, 255], dtype=np.uint8), size=gray.shape)
+    # The output buffer is reused, so start from stale data
+    out = random.randint(0, 256, size=gray.shape + (3,), dtype=np.uint8)
+
+    gui.fuse_mask(gray, mask, out)
+
+    expected = cv2.cvtColor(cv2.bitwise_and(gray, gray, mask=mask), cv2.COLOR_GRAY2BGR)
+    np.testing.assert_array_equal(out, expected)
+
+
+def test_compose_processors_applies_chain_in_order():
+    processors = [lambda image: image + 1, lambda image: image * 2, lambda image: image - 3]
+    process = gui.compose_processors(processors)
+
+    for frame in make_frames(3):
+        expected = frame
+        for fn in processors:
+            expected = fn(expected)
+        np.testing.assert_array_equal(process(frame), expected)
+
+
+def test_compose_processors_unfused_pair():
+    # Segmenting before converting to monochrome can't be fused, so goes through the generated chain
+    process = gui.compose_processors(
+        [gui.SegmentationFunctor(cv2.createBackgroundSubtractorMOG2()), gui.MonochromeFunctor()]
+    )
+    segment = gui.SegmentationFunctor(cv2.createBackgroundSubtractorMOG2())
+    monochrome = gui.MonochromeFunctor()
+
+    for frame in make_frames(2 * gui.BUFFER_COUNT + 1):
+        np.testing.assert_array_equal(process(frame), monochrome(segment(frame)))
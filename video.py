@@ -1,8 +1,12 @@
+import os
 import sys
+import time
 import argparse
 from typing import Tuple
 from pathlib import Path
 
+# Let FFmpeg decode on as many threads as it sees fit
+os.environ.setdefault("OPENCV_FFMPEG_CAPTURE_OPTIONS", "threads;auto")
 import cv2
 
 
@@ -11,10 +15,13 @@ import cv2
 VIDEO_PATH = "data/video_1.mp4"
 FRAME_RATE = 20
 
+# How long, in milliseconds, to wait for a keypress while paused
+PAUSED_KEY_DELAY = 30
 
-def get_input() -> bool:
-    """Checks for a keypress"""
-    return cv2.waitKey(100) & 0xFF
+
+def get_input(delay: int = 1) -> int:
+    """Checks for a keypress, waiting at most delay milliseconds"""
+    return cv2.waitKey(delay) & 0xFF
 
 
 def check_quit(input_key: str):
@@ -39,11 +46,31 @@ def show_frame(args: argparse.Namespace, cap, subtractor):
     return frame
 
 
+def open_capture(video_source: str) -> cv2.VideoCapture:
+    """Open a video source with FFmpeg, using hardware accelerated decoding where OpenCV supports it"""
+    # Hardware acceleration properties were only added in OpenCV 4.5.2
+    if hasattr(cv2, "CAP_PROP_HW_ACCELERATION"):
+        params = [cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY]
+        return cv2.VideoCapture(video_source, cv2.CAP_FFMPEG, params)
+    return cv2.VideoCapture(video_source, cv2.CAP_FFMPEG)
+
+
 def set_frame_back(cap, num_frames: int = 1):
     current_frame = cap.get(cv2.CAP_PROP_POS_FRAMES) - 1
     cap.set(cv2.CAP_PROP_POS_FRAMES, current_frame - num_frames)
 
 
+def parse_resolution(value: str) -> Tuple[int, int]:
+    """Parse a resolution given on the command line as WIDTHxHEIGHT"""
+    try:
+        width, height = (int(size) for size in value.lower().split("x"))
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(f"Expected a resolution as WIDTHxHEIGHT, got {value!r}") from e
+    if width <= 0 or height <= 0:
+        raise argparse.ArgumentTypeError(f"Expected a positive width and height, got {value!r}")
+    return (width, height)
+
+
 def main():
 
     parser = argparse.ArgumentParser()
@@ -51,7 +78,10 @@ def main():
     parser.add_argument("--target-file-path", help="The filepath of the video to extract", type=Path, default=None)
     parser.add_argument("--frame-rate", help="The target frame rate", type=int, default=FRAME_RATE)
     parser.add_argument(
-        "--output-resolution", help="The resolution of the output file", type=Tuple[int, int], default=None
+        "--output-resolution",
+        help="The resolution of the output file, as WIDTHxHEIGHT",
+        type=parse_resolution,
+        default=None,
     )
     parser.add_argument("--monochrome", help="If set, play the video in monochrome", action="store_true")
     parser.add_argument(
@@ -67,7 +97,13 @@ def main():
     )
     args = parser.parse_args()
 
-    cap = cv2.VideoCapture(str(args.video_file_path))
+    # Leave a core for the main loop, which decodes, encodes and displays the frames
+    num_threads = max(2, (os.cpu_count() or 1) - 1)
+    cv2.setUseOptimized(True)
+    cv2.setNumThreads(num_threads)
+    print(f"Using {num_threads} OpenCV threads")
+
+    cap = open_capture(str(args.video_file_path))
     subtractor = cv2.createBackgroundSubtractorMOG2()
 
     if args.target_file_path is not None:
@@ -81,8 +117,19 @@ def main():
         output_resolution = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
     out = cv2.VideoWriter(str(target_file_path), fourcc, args.frame_rate, output_resolution)
 
+    # Pace playback at the source frame rate rather than relying on the keypress timeout
+    source_fps = cap.get(cv2.CAP_PROP_FPS) or args.frame_rate
+    frame_time = 1.0 / source_fps
+    t_prev = time.perf_counter()
+
     while cap.isOpened():
+        time.sleep(max(0.0, frame_time - (time.perf_counter() - t_prev)))
+        t_prev = time.perf_counter()
+
         frame = show_frame(args, cap, subtractor)
+        # The writer silently drops frames which don't match its resolution
+        if frame.shape[1::-1] != output_resolution:
+            frame = cv2.resize(frame, output_resolution, interpolation=cv2.INTER_AREA)
         out.write(frame)
 
         input_key = get_input()
@@ -92,7 +139,8 @@ def main():
             print("Paused")
 
             while True:
-                input_key = get_input()
+                # There's no frame to pace while paused, so block on the keypress instead of spinning
+                input_key = get_input(PAUSED_KEY_DELAY)
                 check_quit(input_key)
 
                 if input_key == ord("b"):